@@ -1,4 +1,4 @@
-import generator
+from collections import Counter
 
 def courseSet(student, ignoreSet=None):
     if ignoreSet is None:
@@ -23,16 +23,164 @@ def group_bf(students, ignoreSet=None):
             # this student is a lone-wolf!
             groups.append(set(schedule))
             continue
-        # combine all intersecting groups
-        bIter = iter(belongs)
-        # skip the first element
-        root = groups[next(bIter)]
+        # combine all intersecting groups into the first one
+        root = groups[belongs[0]]
         root.update(schedule)
-        for groupIndex in bIter:
+        # pop from the back so the remaining indices stay valid
+        for groupIndex in reversed(belongs[1:]):
             root.update(groups.pop(groupIndex))
-            print('Joining')
     return groups
 
+class Grouping:
+    """ Incrementally maintained equivalent of group_bf
+        Students are only counted against their exact enrollment (as a tuple,
+            which is much cheaper to build and hash than a set), so the course
+            groups change only when a distinct enrollment first appears or its
+            last student leaves. New enrollments are joined into the course
+            union-find right away; a vanished one only marks its group, and
+            marked groups are rebuilt from the remaining distinct enrollments
+            the next time groups() is called.
+    """
+    def __init__(self, students=(), ignoreSet=None):
+        self.ignoreSet = ignoreSet
+        # the enrollment each student was added with, student -> tuple
+        self.schedules = {}
+        # enrollment -> number of students with it
+        self.sharing = {}
+        # enrollment -> its courseSet, for the enrollments in sharing
+        self.outlines = {}
+        # courses seen so far, and those of them that ignoreSet names
+        self.seen = set()
+        self.ignored = set()
+        # union-find parent pointers, course -> course
+        self.parent = {}
+        # root course -> courses in its group
+        self.courses = {}
+        # a course from each group that may have split since the last regroup
+        self.dirty = set()
+        self.addStudents(students)
+    def _find(self, c):
+        parent = self.parent
+        while parent[c] is not c:
+            # path halving
+            parent[c] = parent[parent[c]]
+            c = parent[c]
+        return c
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a is b:
+            return
+        # merge the smaller group into the larger one
+        if len(self.courses[a]) < len(self.courses[b]):
+            a, b = b, a
+        self.parent[b] = a
+        self.courses[a].update(self.courses.pop(b))
+    def _join(self, outline):
+        """ Put all of an outline's courses in one group """
+        if not outline:
+            return
+        first = next(iter(outline))
+        if first in self.parent and outline <= self.courses[self._find(first)]:
+            # by far the common case: the courses are already grouped
+            return
+        for c in outline:
+            if c not in self.parent:
+                self.parent[c] = c
+                self.courses[c] = {c}
+            self._union(first, c)
+    def _regroup(self):
+        """ Rebuild the marked groups from the enrollments touching them """
+        roots = {self._find(c) for c in self.dirty}
+        self.dirty.clear()
+        affected = set()
+        for root in roots:
+            affected.update(self.courses.pop(root))
+        for c in affected:
+            del self.parent[c]
+        # courses nobody takes any more simply don't come back
+        for outline in self.outlines.values():
+            if not outline.isdisjoint(affected):
+                self._join(outline)
+    def _apply(self, changes):
+        """ Apply net changes in how many students have each enrollment """
+        sharing = self.sharing
+        outlines = self.outlines
+        seen = self.seen
+        ignored = self.ignored
+        for enrolled, change in changes.items():
+            if change == 0:
+                continue
+            before = sharing.get(enrolled, 0)
+            after = before + change
+            if after:
+                sharing[enrolled] = after
+            else:
+                del sharing[enrolled]
+            if before == 0:
+                outline = frozenset(enrolled)
+                if not outline <= seen:
+                    # match ignored courses by name once, when first seen
+                    for c in outline - seen:
+                        seen.add(c)
+                        if self.ignoreSet and c.name in self.ignoreSet:
+                            ignored.add(c)
+                outline -= ignored
+                outlines[enrolled] = outline
+                self._join(outline)
+            elif after == 0:
+                outline = outlines.pop(enrolled)
+                if outline:
+                    self.dirty.add(next(iter(outline)))
+    def _checkGrouped(self, students, grouped):
+        """ Validate a whole batch before anything is changed """
+        unique = set(students)
+        if len(unique) < len(students):
+            students = list(dict.fromkeys(students))
+        keys = self.schedules.keys()
+        if keys >= unique if grouped else keys.isdisjoint(unique):
+            return students
+        for s in students:
+            if (s in keys) != grouped:
+                raise ValueError("student " + str(s.id) + (
+                    " is not grouped" if grouped else " already grouped"))
+    def addStudent(self, student):
+        """ Add a student using their current enrollment """
+        self.addStudents((student,))
+    def addStudents(self, students):
+        students = self._checkGrouped(list(students), False)
+        new = [tuple(s.getEnrolled()) for s in students]
+        self.schedules.update(zip(students, new))
+        self._apply(Counter(new))
+    def removeStudent(self, student):
+        """ Remove a student and split their group back up if needed """
+        self.removeStudents((student,))
+    def removeStudents(self, students):
+        """ Remove several students; any groups they held together are
+            rebuilt once, on the next call to groups()
+        """
+        students = self._checkGrouped(list(students), True)
+        changes = Counter()
+        changes.subtract(Counter(map(self.schedules.pop, students)))
+        self._apply(changes)
+    def updateStudent(self, student):
+        """ Regroup a student whose enrollment changed (e.g. a new year) """
+        self.updateStudents((student,))
+    def updateStudents(self, students):
+        """ Regroup several students; enrollments shared with other students
+            (or swapped between them) leave the course groups untouched
+        """
+        students = self._checkGrouped(list(students), True)
+        old = Counter(map(self.schedules.__getitem__, students))
+        new = [tuple(s.getEnrolled()) for s in students]
+        self.schedules.update(zip(students, new))
+        changes = Counter(new)
+        changes.subtract(old)
+        self._apply(changes)
+    def groups(self):
+        if self.dirty:
+            self._regroup()
+        return [set(i) for i in self.courses.values()]
+
 def groups_verify(students, groups, ignoreSet=None):
     for i in groups:
         for j in groups:
@@ -50,16 +198,41 @@ def groups_verify(students, groups, ignoreSet=None):
                 else:
                     belongs = g
                     
+def groups_normalize(groups):
+    """ Put groups in a comparable form, ignoring order and empty groups """
+    return {frozenset(g) for g in groups if g}
+
+def grouping_verify(students, grouping, ignoreSet=None):
+    """ Check an incrementally maintained Grouping against group_bf """
+    expected = group_bf(students, ignoreSet) if students else []
+    assert groups_normalize(grouping.groups()) == \
+        groups_normalize(expected), "Grouping diverged from group_bf"
+
 if __name__ == "__main__":
-    reg = generator.makeDefaultRegistrar(generator.gradReqs,
-                                         generator.totalCredits)
-    #generator.simParams["enrollment"] = 30
-    students = generator.simulate(generator.simParams, reg, 4)[0]
-    groups = group_bf(students, ignoreSet=["PE", "Band"])
+    # only the script needs the generator, so don't pay for it on import
+    import generator
+    reg = generator.defaultRegistrar()
+    params = generator.simParams
+    ignore = ["PE", "Band"]
+    #params["enrollment"] = 30
+    # run the simulate loop by hand, keeping a Grouping current every year
+    students = []
+    grouping = Grouping(ignoreSet=ignore)
+    for year in range(4):
+        returning = list(students)
+        dropped, grads = generator.advanceStudents(params, reg, students)
+        newStudents = generator.enrollYear(params, reg, len(students))
+        students.extend(newStudents)
+        generator.allocateSeats(reg, students)
+        gone = set(dropped + grads)
+        grouping.removeStudents(gone)
+        grouping.updateStudents(s for s in returning if s not in gone)
+        grouping.addStudents(newStudents)
+    groups = grouping.groups()
     for i in groups:
         print("group:")
         print("\t" + "\n\t".join(map(str, i)))
-    groups_verify(students, groups)
+    groups_verify(students, groups, ignoreSet=ignore)
     for c in reg.all:
-        if c not in groups[0]:
-            print(c.name)
\ No newline at end of file
+        if not any(c in g for g in groups):
+            print(c.name)
@@ -1,3 +1,4 @@
+import gc
 import random
 from random import randint
 import model
@@ -9,11 +10,13 @@ class Course(model.Course):
         super().__init__(registrar.getNextCourseId(), name, **kwargs)
         self.reg = registrar
     def honors(self, title=None):
+        self.reg.checkMutable()
         self.hasHonors = True
         self.honorsTitle = title if title is not None else self.honorsTitle
         return self
     def credit(self, *creditTypes, amt=1):
         """ Make this course credit bearing """
+        self.reg.checkMutable()
         self.worth = amt
         if len(creditTypes) > 0:
             self.reg.recordCredits(*creditTypes)
@@ -23,8 +26,13 @@ class Course(model.Course):
         """ Set the prerequisites for this course, by title or credit names
             reqs should be a list of course names or credit types
         """
+        self.reg.checkMutable()
         self.preReqs.extend(self.reg.getCourse(name=i) for i in reqs)
         return self
+    def capacity(self, seats, sections=1):
+        """ Limit enrollment to sections of a given size """
+        self.reg.setCapacity(self, seats, sections)
+        return self
     def track(self, track, level):
         """ Make this class part of a core track """
         self.reg.addCourseToTrack(self, track, level)
@@ -36,6 +44,7 @@ class Course(model.Course):
         return self
     def asSpecial(self):
         """ Register the course as a special """
+        self.reg.checkMutable()
         self.special = True
         self.reg.newSpecials(self)
         return self
@@ -168,11 +177,28 @@ def makeDefaultRegistrar(gradReqs, totalGradCredits):
     reg.recordGradReqs(totalGradCredits, **gradReqs)
     return reg
 
-def suggestClasses(reg, student, ignoreElectives=True, ignoreSpecials=True):
+_defaultRegistrar = None
+
+def defaultRegistrar():
+    """ Get the shared, frozen registrar built from gradReqs and totalCredits
+        It is only constructed on the first call; use makeDefaultRegistrar for
+            a fresh registrar that can still be modified.
+    """
+    global _defaultRegistrar
+    if _defaultRegistrar is None:
+        _defaultRegistrar = makeDefaultRegistrar(gradReqs, totalCredits).freeze()
+    return _defaultRegistrar
+
+def suggestClasses(reg, student, ignoreElectives=True, ignoreSpecials=True,
+                   courses=None):
+    """ Split the courses a student can take into required and optional ones
+        courses limits the search (e.g. to courses with free seats); it
+            defaults to every course in the registrar
+    """
     req = []
     options = []
     unmet = reg.getMissingReqs(student)
-    for course in reg.all:
+    for course in reg.all if courses is None else courses:
         if not course.canEnroll(student):
             continue
         if ignoreSpecials and course.isSpecial():
@@ -339,8 +365,118 @@ def advanceStudents(params, reg, students):
         students.remove(s)
     return dropouts, graduates
 
-def simulate(params, reg, years=4, enrollingYears=None):
+def allocateSeats(reg, students):
+    """ Allocate seats in capped courses over the whole cohort at once
+        Each student's current enrollment is treated as their requests. Every
+            capped course admits its requesters by grade (seniors first), then
+            honors, then how early the student asked for it. Students who miss
+            out are dropped from the course and put on its waitlist.
+        Each lost seat is then refilled, seniors first, from the courses that
+            still have room, in suggestClasses order (required courses before
+            electives). A student never gains more courses than they lost, so
+            maxCourses still holds; as many replacements are taken as honors
+            as honors seats were lost, where the course offers honors, and the
+            rest are regular seats.
+        Returns (waitlists, unmet, sections): the students turned away from
+            each course in priority order (including those who were later
+            placed in a replacement), how many requests each course couldn't
+            seat, and how many sections each capped course ends up using
+    """
+    # the pass allocates many small containers but no reference cycles, and
+    # on a full cohort the collector's passes over the student records cost
+    # more than the allocation itself
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _allocateSeats(reg, students)
+    finally:
+        if collecting:
+            gc.enable()
+
+def _allocateSeats(reg, students):
+    capacities = reg.capacities
+    if not capacities:
+        return {}, {}, {}
+    # each course's requests are bucketed by (-grade, not honors, rank);
+    # there are only a few dozen such priorities, so sorting the bucket keys
+    # orders the whole queue, and students stay in cohort order within one
+    requests = {course: {} for course in capacities}
+    for n, s in enumerate(students):
+        for rank, course in enumerate(s.getEnrolled()):
+            buckets = requests.get(course)
+            if buckets is not None:
+                priority = (-s.grade, course not in s.asHonors, rank)
+                buckets.setdefault(priority, []).append(n)
+    capacity = {course: reg.getCapacity(course) for course in capacities}
+    filled = {}
+    waitlists = {}
+    unmet = {}
+    # the courses each student lost, indexed like students
+    lost = [[] for s in students]
+    for course, buckets in requests.items():
+        seats = capacity[course]
+        queue = [n for p in sorted(buckets) for n in buckets[p]]
+        filled[course] = min(len(queue), seats)
+        if len(queue) <= seats:
+            continue
+        waiting = queue[seats:]
+        for n in waiting:
+            lost[n].append(course)
+        waitlists[course] = list(map(students.__getitem__, waiting))
+        unmet[course] = len(waiting)
+    # offer the bumped students whatever still has room, seniors first
+    bumped = [n for n, courses in enumerate(lost) if courses]
+    bumped.sort(key=lambda n: -students[n].grade)
+    available = [c for c in reg.all
+                 if c not in capacities or filled[c] < capacity[c]]
+    # suggestClasses over the available courses only depends on the grade,
+    # which of those courses (and their prerequisites) were passed or taken,
+    # and the credits earned toward requirements they give credit for, so
+    # students alike in those share one ranking; courses that fill up later
+    # are skipped when enrolling
+    relevant = set(available).union(*(c.preReqs for c in available))
+    titles = [title for title in reg.gradReqs
+              if any(title in c.credits for c in available)]
+    suggestions = {}
+    for n in bumped:
+        s = students[n]
+        courses = lost[n]
+        needed = len(courses)
+        # honors seats lost are carried over to the replacements
+        honors = len(s.asHonors.intersection(courses))
+        s.drop(*courses)
+        key = (s.grade, frozenset(relevant.intersection(s.passedClasses)),
+               frozenset(relevant.intersection(s.failedClasses)),
+               tuple(map(s.credits.get, titles)))
+        ranked = suggestions.get(key)
+        if ranked is None:
+            req, opts = suggestClasses(reg, s, ignoreElectives=False,
+                                       courses=available)
+            # suggestClasses ranks the most useful required course last
+            ranked = suggestions[key] = req[::-1] + opts
+        for c in ranked:
+            if needed == 0:
+                break
+            if c in capacities and filled[c] >= capacity[c]:
+                continue
+            if s.isEnrolledIn(c):
+                continue
+            asHonors = honors > 0 and c.hasHonors
+            s.enroll(c, asHonors)
+            honors -= asHonors
+            needed -= 1
+            if c in capacities:
+                filled[c] += 1
+    sections = {}
+    for course, (seats, _) in capacities.items():
+        # round up; a course with no seats uses no sections
+        sections[course] = -(-filled[course] // seats) if seats else 0
+    return waitlists, unmet, sections
+
+def simulate(params, reg, years=4, enrollingYears=None, seatReport=None):
     # simulate four years of school
+    # if seatReport is a list, each year's allocateSeats result (waitlists,
+    # unmet demand and sections used) is appended
     students = []
     dropouts = []
     graduates = []
@@ -355,10 +491,13 @@ def simulate(params, reg, years=4, enrollingYears=None):
             enrolled += len(newStudents)
             students.extend(newStudents)
             enrollingYears -= 1
+        seats = allocateSeats(reg, students)
+        if seatReport is not None:
+            seatReport.append(seats)
     return students, enrolled, dropouts, graduates
 
 if __name__ == "__main__":
-    reg = makeDefaultRegistrar(gradReqs, totalCredits)
+    reg = defaultRegistrar()
     students, enrolled, dropouts, graduates = simulate(simParams, reg, 5, 1)
     for i in students:
         if reg.getMissingReqs(i).keys():
@@ -1,9 +1,16 @@
+from types import MappingProxyType
+
 def _regMethod(func):
     """ Decorate Registrar methods so that they perform standard book keeping
         operations
     """
     def wrap(*args):
-        args[0].all.extend(args[1:])
+        reg = args[0]
+        reg.checkMutable()
+        reg.all.extend(args[1:])
+        for c in args[1:]:
+            # keep the first course registered under a name, like a scan would
+            reg.byName.setdefault(c.name, c)
         func(*args)
     return wrap
 
@@ -22,6 +29,40 @@ class Registrar:
         self.credits = set()
         self.gradReqs = {}
         self.gradCredits = 0
+        # name -> course index so lookups don't scan self.all
+        self.byName = {}
+        # course -> (seats per section, sections); uncapped courses are absent
+        self.capacities = {}
+        self.frozen = False
+    def freeze(self):
+        """ Make the registrar read only; further registration will raise
+            Used for shared, prebuilt registrars (see generator.defaultRegistrar)
+            The containers here and the prerequisite and credit lists of the
+                courses become tuples, frozensets or read only mappings. Plain
+                attributes of a course (worth, hasHonors...) can't be locked, so
+                don't assign to them directly on a shared registrar.
+        """
+        if self.frozen:
+            return self
+        for c in self.all:
+            c.preReqs = tuple(c.preReqs)
+            c.credits = tuple(c.credits)
+        self.tracks = MappingProxyType({
+            track: MappingProxyType({l: tuple(courses)
+                                     for l, courses in levels.items()})
+            for track, levels in self.tracks.items()})
+        self.all = tuple(self.all)
+        self.electives = tuple(self.electives)
+        self.specials = tuple(self.specials)
+        self.credits = frozenset(self.credits)
+        self.gradReqs = MappingProxyType(self.gradReqs)
+        self.byName = MappingProxyType(self.byName)
+        self.capacities = MappingProxyType(self.capacities)
+        self.frozen = True
+        return self
+    def checkMutable(self):
+        if self.frozen:
+            raise RuntimeError("cannot modify a frozen Registrar")
     def getCourse(self, id=None, name=None):
         if id is not None:
             return self.getCourseById(id)
@@ -29,10 +70,7 @@ class Registrar:
             return self.getCourseByName(name)
         return None
     def getCourseByName(self, name):
-        for i in self.all:
-            if i.name == name:
-                return i
-        return None
+        return self.byName.get(name)
     def getCourseById(self, id):
         # see if the course is at that index
         try:
@@ -60,9 +98,22 @@ class Registrar:
     def newElectives(self, *args):
         self.electives.extend(args)
     def addCourseToTrack(self, c, track, level):
+        self.checkMutable()
         recordedTrack = self.tracks.setdefault(track, {})
         coursesInTrack = recordedTrack.setdefault(level, [])
         coursesInTrack.append(c)
+    def setCapacity(self, course, seats, sections=1):
+        """ Limit a course to sections of a given size """
+        self.checkMutable()
+        if seats < 0 or sections < 0:
+            raise ValueError("capacity must not be negative")
+        self.capacities[course] = (seats, sections)
+    def getCapacity(self, course):
+        """ Total seats in a course, or None if it is uncapped """
+        cap = self.capacities.get(course)
+        if cap is None:
+            return None
+        return cap[0] * cap[1]
     def getCoursesAfterLevel(self, track, level):
         """ Get succeeding courses in a track, including the level - course """
         reqs = []
@@ -82,13 +133,16 @@ class Registrar:
     def getCoursesRequiring(self, req):
         return [course for course in self.all if course.hasPrerequisite(req)]
     def getNextCourseId(self):
+        self.checkMutable()
         res = self.nextId
         self.nextId += 1
         return res
     def recordCredits(self, *titles):
         """ Record that titles are a type of credit """
+        self.checkMutable()
         self.credits.update(titles)
     def recordGradReqs(self, totalReq, **credits):
+        self.checkMutable()
         self.gradReqs.update(credits)
         self.totalReq = totalReq
     def canGraduate(self, student):
@@ -136,6 +190,9 @@ class Registrar:
         base = '   '*indent + str(c)
         if c.hasHonors:
             base += '\tw/ HON ' + c.honorsTitle
+        if c in self.capacities:
+            seats, sections = self.capacities[c]
+            base += '\t' + str(sections) + ' x ' + str(seats) + ' seats'
         return base
 
 class Student:
@@ -171,6 +228,12 @@ class Student:
             if not course.hasHonors:
                 raise ValueError("Course", str(course), "does not have honors")
             self.asHonors.add(course)
+    def drop(self, *courses):
+        """ Remove courses from this year's enrollment """
+        dropped = set(courses)
+        self.enrollmentHistory[-1] = [i for i in self.enrollmentHistory[-1]
+                                      if i not in dropped]
+        self.asHonors.difference_update(dropped)
     def getEnrolled(self):
         return self.enrollmentHistory[-1]
     def isEnrolledIn(self, course):